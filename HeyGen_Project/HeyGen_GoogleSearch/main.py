@@ -1,19 +1,23 @@
 import os
 import time
+import random
 import subprocess
 import requests
 import re
 import json
+import diskcache # 新聞搜尋結果快取 (磁碟，含過期時間)
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor # 用於多執行緒加速上傳
+from concurrent.futures import ThreadPoolExecutor, as_completed # 用於多執行緒加速上傳
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry # 用於 5xx 錯誤自動重試
 
 # --- SDK 與 工具 導入 ---
 from google import genai
 from google.genai import types
 from pptx import Presentation
 from pptx.util import Pt, Inches
-from pdf2image import convert_from_path
+import pypdfium2 as pdfium # 於程序內將 PDF 渲染為圖片 (不需安裝 Poppler)
 
 # ================= 1. 環境與參數設定 =================
 
@@ -27,8 +31,8 @@ HEYGEN_API_KEY = os.getenv("HEYGEN_API_KEY")
 if not GEMINI_API_KEY or not HEYGEN_API_KEY:
     raise ValueError(" 錯誤：請確認 .env 檔案中包含有效的 API Key")
 
-# 初始化 Google Gemini Client
-client = genai.Client(api_key=GEMINI_API_KEY)
+# Google Gemini Client 延遲到第一次使用時才建立 (見 get_client)
+_CLIENT = None
 
 # --- 用戶個人化設定 ---
 USER_NAME = "j" 
@@ -36,6 +40,12 @@ CHANNEL_NAME = "科技全球焦點"
 TEMPLATE_PPPTX = "tech_template.pptx" # 簡報模板檔案名稱
 OUTPUT_DIR = "outputs"                # 輸出檔案存放目錄
 FINAL_VIDEO_NAME = "final_news_video.mp4"
+RENDER_DPI = 200                      # 投影片轉圖片的解析度
+NEWS_FONT_SIZE = Pt(24)               # 新聞摘要字體大小 (預先建立，迴圈內直接重複使用)
+NEWS_SPACE_AFTER = Pt(24)             # 新聞段落間距
+NEWS_CACHE_DIR = os.path.join(OUTPUT_DIR, ".news_cache") # 新聞搜尋結果快取位置
+NEWS_CACHE_TTL = 3 * 3600             # 快取有效時間 (秒)
+PNG_COMPRESS_LEVEL = 1                # PNG 壓縮等級 (1 = 最快，圖片上傳後即丟棄，檔案稍大無妨)
 
 # --- HeyGen API 參數 ---
 API_HOST = "https://api.heygen.com"
@@ -43,44 +53,78 @@ GENERATE_URL_V2 = f"{API_HOST}/v2/video/generate" # v2 影片生成接口
 UPLOAD_URL_V1 = "https://upload.heygen.com/v1/asset" # v1 資產上傳接口
 VIDEO_STATUS_URL_V1 = f"{API_HOST}/v1/video_status.get" # 查詢生成狀態
 
+# --- HTTP 連線池 ---
+# 所有 HeyGen 請求共用同一個 Session，重複使用 keep-alive 連線 (省去每次的 TLS 握手)
+# 遇到 5xx 伺服器錯誤時自動重試 3 次
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504])
+))
+
 # --- 數字人 (Avatar) 與 聲音 ID 設定 ---
 # 建議：這些 ID 可以從 HeyGen 網頁版 URL 或 API 列表獲取
 TALKING_PHOTO_ID = "8c6187262e744939bb335949024e3ec5"
 VOICE_ID_ZH = "4158cf2ef85d4ccc856aacb1c47dbb0c" # 中文聲音
 VOICE_ID_EN = "cef3bc4e0a84424cafcde6f2cf466c97" # 英文聲音 (備用)
 
+# --- 渲染狀態輪詢設定 (指數退避) ---
+# 由 2 秒開始，每次等待時間乘以 1.5 倍，最長 20 秒
+POLL_INITIAL_DELAY = 2.0
+POLL_BACKOFF_FACTOR = 1.5
+POLL_MAX_DELAY = 20.0
+
 # ⚠️ LibreOffice 路徑設定
 # 這是將 PPT 轉為 PDF 的關鍵工具，請確保路徑與您電腦安裝位置一致
 WINDOWS_SOFFICE_PATH = r"C:\Program Files\LibreOffice\program\soffice.exe"
 
 # ================= 2. 工具函數 =================
 
+# --- 預先編譯的正規表達式 (避免每次呼叫重新查詢 regex 快取) ---
+_CJK_RE = re.compile(r"[\u4e00-\u9fff]")                     # 中文字元偵測
+_JSON_ARRAY_RE = re.compile(r'\[\s*\{.*\}\s*\]', re.DOTALL)      # 最外層的 [ {...} ] 陣列
+
+def get_client():
+    """
+    取得共用的 Gemini Client，第一次呼叫時才建立，之後重複使用同一個連線
+    """
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = genai.Client(api_key=GEMINI_API_KEY)
+    return _CLIENT
+
 def safe_extract_json(text):
     """
     從 AI 回傳的文字中安全提取 JSON 字串。
     AI 有時會包裹 Markdown 標籤 (```json ... ```)，此函數用於去除這些雜訊。
     """
     if not text: return None
-    # 嘗試抓取 ```json 包裹的內容
-    match = re.search(r'```json\s*(.*?)\s*```', text, re.DOTALL)
-    if match: return match.group(1)
+    # 嘗試抓取 ```json 包裹的內容 (用 str.find 直接定位，比 regex 快且不會回溯)
+    start = text.find("```json")
+    if start != -1:
+        end = text.find("```", start + 7)
+        if end != -1: return text[start + 7:end].strip()
     # 若無 Markdown，嘗試抓取最外層的陣列 []
-    match = re.search(r'\[\s*\{.*\}\s*\]', text, re.DOTALL)
+    match = _JSON_ARRAY_RE.search(text)
     if match: return match.group(0)
     return text.strip()
 
 # ================= 3. 核心功能：內容生成 =================
 
-def fetch_content_and_make_pptx(topic, intro_script):
+def search_news(topic, current_date_str):
     """
-    流程 A: 使用 Gemini 聯網搜尋新聞 -> 整理成 JSON -> 製作 PPT -> 生成口播稿
+    使用 Gemini + Google Search 搜尋新聞，整理成 JSON List。
+    同一天內相同主題的搜尋結果差異不大，因此以 (主題, 日期) 為 key 快取數小時，
+    重複執行時可省下數秒的搜尋與生成時間。
     """
-    now = datetime.now()
-    current_date_str = now.strftime('%Y-%m-%d')
-    
-    print(f" [1/5] 正在搜尋「{topic}」")
-    
-    # --- A. Gemini 搜尋與內容生成 ---
+    cache_key = f"{topic}|{current_date_str}"
+    with diskcache.Cache(NEWS_CACHE_DIR) as cache:
+        cached = cache.get(cache_key)
+    if cached is not None:
+        print(f"   >>> 使用快取的搜尋結果 (共 {len(cached)} 則新聞)")
+        return cached
+
     # Prompt 設計重點：指定角色、時間、強制 JSON 格式、限制字數
     prompt = f"""
     你是一位資深新聞編輯，今天是 {current_date_str}。
@@ -106,7 +150,7 @@ def fetch_content_and_make_pptx(topic, intro_script):
 
     try:
         # 呼叫 Gemini API
-        resp = client.models.generate_content(
+        resp = get_client().models.generate_content(
             model="gemini-2.5-flash-lite", # 使用輕量快速的模型
             contents=prompt,
             config=types.GenerateContentConfig(tools=[search_tool], temperature=0.2) # 低溫創造性，求精準
@@ -118,18 +162,41 @@ def fetch_content_and_make_pptx(topic, intro_script):
                 if hasattr(part, 'text') and part.text:
                     full_text += part.text
         
+        # 沒有回傳任何文字就不必解析，直接走錯誤處理
+        if not full_text.strip():
+            raise ValueError("Gemini 未回傳任何內容")
+
         # 解析 JSON 資料
         raw_data = json.loads(safe_extract_json(full_text))
         if not isinstance(raw_data, list): raw_data = [raw_data] # 確保格式是 List
         
         print(f"   >>> 搜尋完成，第一筆資料範例: {raw_data[0] if raw_data else '無資料'}")
         print(f"   >>> 共生成 {len(raw_data)} 則新聞。")
+
+        # 成功且有內容的結果才寫入快取 (失敗的假資料與空結果不快取，避免整整數小時都拿到空清單)
+        if raw_data:
+            with diskcache.Cache(NEWS_CACHE_DIR) as cache:
+                cache.set(cache_key, raw_data, expire=NEWS_CACHE_TTL)
             
     except Exception as e:
         print(f" Gemini 錯誤: {e}")
         # 錯誤處理：若 API 失敗，生成一條假資料讓程式能繼續跑，方便 Debug
         raw_data = [{"summary": f"今日{topic}相關新聞整理 (擷取失敗，請檢查 API 或網絡)"}]
 
+    return raw_data
+
+def fetch_content_and_make_pptx(topic, intro_script):
+    """
+    流程 A: 使用 Gemini 聯網搜尋新聞 -> 整理成 JSON -> 製作 PPT -> 生成口播稿
+    """
+    now = datetime.now()
+    current_date_str = now.strftime('%Y-%m-%d')
+    
+    print(f" [1/5] 正在搜尋「{topic}」")
+    
+    # --- A. Gemini 搜尋與內容生成 (同主題同日期會沿用快取) ---
+    raw_data = search_news(topic, current_date_str)
+
     # --- B. PPTX 生成 ---
     
     # 載入模板或建立新簡報
@@ -185,9 +252,9 @@ def fetch_content_and_make_pptx(topic, intro_script):
             # 將新聞寫入 PPT
             p = tf.add_paragraph()
             p.text = f"{news_content}" 
-            p.font.size = Pt(24) 
+            p.font.size = NEWS_FONT_SIZE
             p.font.bold = True
-            p.space_after = Pt(24) # 段落間距
+            p.space_after = NEWS_SPACE_AFTER # 段落間距
 
         # --- 自動生成流暢的過場口播 ---
         if titles_on_page:
@@ -219,8 +286,10 @@ def fetch_content_and_make_pptx(topic, intro_script):
 def convert_pptx_to_images(path):
     """
     使用 LibreOffice 將 PPTX -> PDF -> PNG 圖片
+    此函數為 generator：每存好一張圖片就立即 yield (頁碼 index, 圖片路徑)，
+    讓呼叫端可以一邊轉檔一邊上傳 (順序不保證，請以 index 排序)
     """
-    print(" [2/5] PPT 轉圖片...")
+    print(" [2/5] PPT 轉圖片並同步上傳素材...")
     soffice = WINDOWS_SOFFICE_PATH if os.path.exists(WINDOWS_SOFFICE_PATH) else "soffice"
     
     # 呼叫系統指令執行轉檔 (--headless 代表不開啟圖形介面，背景執行)
@@ -228,14 +297,25 @@ def convert_pptx_to_images(path):
     
     pdf_path = os.path.join(OUTPUT_DIR, os.path.basename(path).replace(".pptx", ".pdf"))
     
-    # 將 PDF 每一頁轉為圖片
-    images = convert_from_path(pdf_path, dpi=200)
-    paths = []
-    for i, img in enumerate(images):
-        p = os.path.join(OUTPUT_DIR, f"slide_{i+1}.png")
-        img.save(p, "PNG")
-        paths.append(p)
-    return paths
+    # 將 PDF 每一頁轉為圖片 (pypdfium2 在程序內渲染，不需再呼叫外部 pdftoppm)
+    # pdfium 不支援多執行緒渲染，因此依序渲染；PNG 壓縮 (CPU 密集) 則平行處理
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            pending = {}
+            for i, page in enumerate(pdf):
+                p = os.path.join(OUTPUT_DIR, f"slide_{i+1}.png")
+                img = page.render(scale=RENDER_DPI / 72).to_pil()
+                pending[executor.submit(img.save, p, "PNG", compress_level=PNG_COMPRESS_LEVEL)] = (i, p)
+                # 已經存好的圖片立即交出，不必等整份簡報轉完
+                for future in [f for f in pending if f.done()]:
+                    future.result()
+                    yield pending.pop(future)
+            for future in as_completed(pending):
+                future.result()
+                yield pending[future]
+    finally:
+        pdf.close()
 
 def convert_custom_cover(file_path):
     """
@@ -254,11 +334,14 @@ def convert_custom_cover(file_path):
     # 若是 PDF 格式，取第一頁轉圖片
     if ext == ".pdf":
         print(f"處理 PDF 封面...")
-        images = convert_from_path(file_path, dpi=200, first_page=1, last_page=1)
-        if images:
-            save_path = os.path.join(OUTPUT_DIR, "custom_cover_final.png")
-            images[0].save(save_path, "PNG")
-            return save_path
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            if len(pdf) > 0:
+                save_path = os.path.join(OUTPUT_DIR, "custom_cover_final.png")
+                pdf[0].render(scale=RENDER_DPI / 72).to_pil().save(save_path, "PNG")
+                return save_path
+        finally:
+            pdf.close()
             
     return file_path # 如果原本就是圖片，直接回傳路徑
 
@@ -267,26 +350,44 @@ def upload_to_heygen(file_path):
     將單張圖片上傳至 HeyGen 資產庫，取得 asset_id
     """
     headers = {"X-Api-Key": HEYGEN_API_KEY, "Content-Type": "image/png"}
-    with open(file_path, "rb") as f: data = f.read()
     # 參數 type=image 告訴 HeyGen 這是圖片
-    resp = requests.post(UPLOAD_URL_V1, headers=headers, data=data, params={"type": "image"})
+    # 直接傳入檔案物件，由 requests 從磁碟分段送出 (不必先整張讀進記憶體)
+    with open(file_path, "rb") as f:
+        resp = SESSION.post(UPLOAD_URL_V1, headers=headers, data=f, params={"type": "image"})
     return resp.json()["data"]["id"]
 
-def create_full_video(image_paths, scripts):
+def upload_slides(slide_images, cover_path=None):
     """
-    組合 HeyGen 影片場景
+    邊轉檔邊上傳：slide_images 每產生一張圖片 (index, path)，就立即送進上傳佇列，
+    讓上傳與 PPT 轉圖片同時進行。若有自訂封面，則以封面取代第一張投影片。
+    回傳依頁序排列的 asset_id 列表
     """
-    print(f" [3/5] 生成影片中 (素材上傳與合成)...")
-    
     # 使用 ThreadPool 平行上傳圖片，加快速度 (一次上傳 5 張)
     with ThreadPoolExecutor(max_workers=5) as executor:
-        bg_ids = list(executor.map(upload_to_heygen, image_paths))
+        futures = {}
+        if cover_path:
+            futures[executor.submit(upload_to_heygen, cover_path)] = 0
+        for i, path in slide_images:
+            if i == 0 and cover_path: continue # 第一張已由自訂封面取代
+            futures[executor.submit(upload_to_heygen, path)] = i
+
+        bg_ids = {}
+        for future in as_completed(futures):
+            bg_ids[futures[future]] = future.result()
+
+    return [bg_ids[i] for i in sorted(bg_ids)]
+
+def create_full_video(bg_ids, scripts):
+    """
+    組合 HeyGen 影片場景 (bg_ids 為已上傳的背景圖片 asset_id，依頁序排列)
+    """
+    print(f" [3/5] 生成影片中...")
     
     scenes = []
     # 將每一張圖片 (bg_id) 與對應的口播稿 (script) 配對
     for bg_id, script in zip(bg_ids, scripts):
         # 簡單的語言判斷：如果有中文字就用中文語音，否則用英文
-        v_id = VOICE_ID_ZH if re.search(r"[\u4e00-\u9fff]", script) else VOICE_ID_EN
+        v_id = VOICE_ID_ZH if _CJK_RE.search(script) else VOICE_ID_EN
         
         scenes.append({
             "character": {
@@ -309,9 +410,30 @@ def create_full_video(image_paths, scripts):
 
     # 發送生成請求
     payload = {"video_inputs": scenes, "aspect_ratio": "16:9", "test": False, "caption": True}
-    resp = requests.post(GENERATE_URL_V2, json=payload, headers={"X-Api-Key": HEYGEN_API_KEY})
+    resp = SESSION.post(GENERATE_URL_V2, json=payload, headers={"X-Api-Key": HEYGEN_API_KEY})
     return resp.json()["data"]["video_id"]
 
+def stream_download(url, output_path, chunk_size=1 << 20):
+    """
+    以串流方式下載檔案，邊接收邊寫入磁碟 (每次 1 MiB)
+    避免將整支影片一次讀進記憶體
+    """
+    with SESSION.get(url, stream=True) as r:
+        r.raise_for_status()
+        with open(output_path, "wb") as f:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+    return output_path
+
+def retry_after_seconds(response, default=5):
+    """
+    讀取 HTTP Retry-After 標頭 (秒數)，無法解析時使用預設值
+    """
+    try:
+        return max(int(response.headers.get("Retry-After", default)), 0)
+    except ValueError:
+        return default
+
 def download_video(video_id, output_video_path):
     """
     輪詢 (Polling) 檢查影片生成狀態，完成後下載
@@ -319,30 +441,43 @@ def download_video(video_id, output_video_path):
     print(" [4/5] 等待 HeyGen 渲染...")
     headers = {"X-Api-Key": HEYGEN_API_KEY}
     start_time = time.time()
+    delay = POLL_INITIAL_DELAY
     
     while True:
         try:
-            r = requests.get(f"{VIDEO_STATUS_URL_V1}?video_id={video_id}", headers=headers).json()
-            data = r.get("data", {})
+            resp = SESSION.get(f"{VIDEO_STATUS_URL_V1}?video_id={video_id}", headers=headers, timeout=10)
+            resp.raise_for_status()
+            data = resp.json().get("data") or {} # data 為 null 時也視為尚未就緒
             status = data.get("status")
-        except: 
-            time.sleep(5); continue # 若網路請求失敗，稍微等待重試
+        except requests.HTTPError as e:
+            code = e.response.status_code
+            if code == 429: # 觸發速率限制：依照 Retry-After 指示等待
+                time.sleep(retry_after_seconds(e.response)); continue
+            if code >= 500: # 伺服器暫時性錯誤 (連線池已自動重試過)
+                time.sleep(delay); continue
+            raise # 其餘 4xx (例如 API Key 錯誤) 為致命錯誤，直接中止
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.RetryError, ValueError):
+            time.sleep(delay); continue # 網路中斷、逾時或回應不是 JSON，稍候重試
         
         if status == "completed":
             print(f"\n   >>> 渲染完成！下載中...")
-            # 下載影片
-            if data.get("video_url"):
-                with open(output_video_path, "wb") as f: f.write(requests.get(data["video_url"]).content)
-            # 下載字幕 (如果有)
-            if data.get("caption_url"):
-                with open(output_video_path.replace(".mp4", ".srt"), "wb") as f: f.write(requests.get(data["caption_url"]).content)
+            # 影片與字幕 (如果有) 是兩個獨立的下載，同時進行
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = []
+                if data.get("video_url"):
+                    futures.append(executor.submit(stream_download, data["video_url"], output_video_path))
+                if data.get("caption_url"):
+                    futures.append(executor.submit(stream_download, data["caption_url"], output_video_path.replace(".mp4", ".srt")))
+                for future in futures: future.result() # 等待下載完成 (並拋出錯誤)
             break
         elif status == "failed": 
             raise Exception(f"渲染失敗: {data.get('error')}")
         
         # 顯示等待秒數
         print(f"   ...已等待 {int(time.time()-start_time)} 秒 ({status})", end="\r")
-        time.sleep(15) # 每 15 秒檢查一次，避免過於頻繁
+        # 指數退避 + 隨機抖動：短影片能更快偵測完成，長影片也不會過於頻繁查詢
+        time.sleep(delay + random.uniform(0, 0.5))
+        delay = min(delay * POLL_BACKOFF_FACTOR, POLL_MAX_DELAY)
 
 # ================= 5. 主程式入口 =================
 
@@ -362,16 +497,16 @@ if __name__ == "__main__":
         # 步驟 1: 獲取內容並製作 PPT
         pptx_path, scripts = fetch_content_and_make_pptx(topic, intro_script)
         
-        # 步驟 2: 轉換圖片
-        images = convert_pptx_to_images(pptx_path)
-
-        # 步驟 3: 若有自訂封面，替換第一張圖片
+        # 步驟 2: 若有自訂封面，先轉為圖片 (將取代第一張投影片)
+        cover_path = None
         if custom_cover and os.path.exists(custom_cover):
-            final_cover_path = convert_custom_cover(custom_cover)
-            if final_cover_path: images[0] = final_cover_path
+            cover_path = convert_custom_cover(custom_cover)
+
+        # 步驟 3: 轉換圖片，每轉好一張就立即上傳 (轉檔與上傳同時進行)
+        bg_ids = upload_slides(convert_pptx_to_images(pptx_path), cover_path)
 
-        # 步驟 4: 上傳並生成影片
-        video_id = create_full_video(images, scripts)
+        # 步驟 4: 生成影片
+        video_id = create_full_video(bg_ids, scripts)
         
         # 步驟 5: 下載成品
         download_video(video_id, os.path.join(OUTPUT_DIR, FINAL_VIDEO_NAME))
@@ -1,14 +1,21 @@
 import os
 import time
+import random
+import asyncio
 import subprocess
 import platform
 import requests
 import re
+import json
+import hashlib
+import diskcache  # 講稿快取 (以圖片內容雜湊為 key)
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from google import genai  # 新版 SDK import
 from google.genai import types
-from pdf2image import convert_from_path
+import pypdfium2 as pdfium  # 於程序內渲染 PDF (不需安裝 Poppler)
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 # ================= 1. 環境設定 =================
 
@@ -27,8 +34,17 @@ GENERATE_URL_V2 = f"{API_HOST}/v2/video/generate"
 UPLOAD_URL_V1 = "https://upload.heygen.com/v1/asset"
 VIDEO_STATUS_URL_V1 = f"{API_HOST}/v1/video_status.get"
 
+# --- HTTP 連線池 (重複使用 keep-alive 連線，省去每次請求的 TLS 握手) ---
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504])
+))
+
 # --- 專案參數 ---
 GEMINI_MODEL_NAME = "gemini-2.5-flash-lite" 
+GEMINI_MAX_CONCURRENCY = 5  # 同時送往 Gemini 的請求上限 (避免觸發速率限制)
 
 TALKING_PHOTO_ID = "8c6187262e744939bb335949024e3ec5"
 VOICE_ID_EN = "cef3bc4e0a84424cafcde6f2cf466c97"
@@ -37,14 +53,36 @@ VOICE_ID_ZH = "4158cf2ef85d4ccc856aacb1c47dbb0c"
 INPUT_PPTX = "test.pptx"
 OUTPUT_VIDEO = "final_output.mp4"
 OUTPUT_DIR = "outputs"
+RENDER_DPI = 200  # 投影片圖片解析度
+SCRIPT_CACHE_DIR = os.path.join(OUTPUT_DIR, ".script_cache")  # Gemini 講稿快取位置
+PNG_COMPRESS_LEVEL = 1  # PNG 壓縮等級 (1 = 最快；圖片上傳後即不再使用，檔案稍大無妨)
+
+# 渲染狀態輪詢：由 2 秒開始，每次乘以 1.5 倍，最長 20 秒
+POLL_INITIAL_DELAY = 2.0
+POLL_BACKOFF_FACTOR = 1.5
+POLL_MAX_DELAY = 20.0
+
+# 中文字元偵測 (預先編譯，避免每個場景重複查詢 regex 快取)
+_CJK_RE = re.compile(r"[\u4e00-\u9fff]")
 
 # Windows LibreOffice 路徑 (請確認此路徑是否正確)
 WINDOWS_SOFFICE_PATH = r"C:\Program Files\LibreOffice\program\soffice.exe"
 
 # ================= 2. 功能函數 =================
 
+_CLIENT = None
+
+def get_client():
+    """
+    取得共用的 Gemini Client (第一次呼叫時才建立，之後重複使用同一個連線)
+    """
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = genai.Client(api_key=GEMINI_API_KEY)
+    return _CLIENT
+
 def detect_voice_id(text):
-    if re.search(r"[\u4e00-\u9fff]", text):
+    if _CJK_RE.search(text):
         return VOICE_ID_ZH
     return VOICE_ID_EN
 
@@ -86,62 +124,158 @@ def convert_pptx_to_images(pptx_path):
         except Exception as e:
             raise Exception(f"LibreOffice 轉檔失敗: {e}\n請確認已安裝 LibreOffice 並設定正確路徑。")
 
-    # 2. PDF -> Images
+    # 2. PDF -> Images (pypdfium2 直接在程序內渲染，不需再呼叫外部 pdftoppm)
     print("   正在將 PDF 轉換為圖片...")
     try:
-        images = convert_from_path(pdf_path, dpi=200)
+        pdf = pdfium.PdfDocument(pdf_path)
     except Exception as e:
-        raise Exception(f"Poppler 錯誤: {e}\n請確認已安裝 Poppler 並加入系統環境變數。")
+        raise Exception(f"PDF 讀取錯誤: {e}")
 
+    # pdfium 不支援多執行緒渲染，因此依序渲染；PNG 壓縮 (zlib, CPU 密集) 交給 ThreadPool 平行處理
     image_paths = []
-    for i, image in enumerate(images):
-        path = os.path.join(OUTPUT_DIR, f"slide_{i+1}.png")
-        image.save(path, "PNG")
-        image_paths.append(path)
+    try:
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            futures = []
+            for i, page in enumerate(pdf):
+                path = os.path.join(OUTPUT_DIR, f"slide_{i+1}.png")
+                image = page.render(scale=RENDER_DPI / 72).to_pil()
+                futures.append(executor.submit(image.save, path, "PNG", compress_level=PNG_COMPRESS_LEVEL))
+                image_paths.append(path)
+            for future in futures:
+                future.result()
+    finally:
+        pdf.close()
 
     return image_paths
 
-def generate_scripts(image_paths):
+SLIDE_PROMPT = "你是專業講師。請用繁體中文(台灣)，針對這張簡報生成約 25 秒的口語講稿。直接輸出文字，不要有Markdown格式。"
+BATCH_PROMPT = (
+    "你是專業講師。以上依序為 {count} 張簡報，請用繁體中文(台灣)，針對每一張投影片各生成約 25 秒的口語講稿，不要有Markdown格式。"
+    "以 JSON array 輸出，每個元素為一張投影片的講稿字串，順序與數量需與輸入圖片一致。"
+)
+
+async def generate_scripts_batch(client, file_refs):
     """
-    【更新版】使用 google-genai (v1.0+) 新版 SDK
+    將所有投影片圖片放進同一個請求，一次取回全部講稿 (N 次往返 -> 1 次)
+    file_refs: {投影片 index: 已上傳的檔案}，回傳 {投影片 index: 講稿}
     """
-    print(f" [2/5] Gemini ({GEMINI_MODEL_NAME}) 正在看圖說故事...")
-    
-    # 初始化 Client
-    client = genai.Client(api_key=GEMINI_API_KEY)
-    
-    scripts = []
-    for i, img_path in enumerate(image_paths):
-        print(f"   分析第 {i+1} 頁...")
-        
-        try:
-            # 1. 上傳檔案 (新版 SDK 直接上傳，通常無需長時間等待處理)
-            file_ref = client.files.upload(
-                file=img_path,
-                config={'display_name': f"Slide_{i}"}
-            )
-            
-            # 2. 生成內容
-            prompt = "你是專業講師。請用繁體中文(台灣)，針對這張簡報生成約 25 秒的口語講稿。直接輸出文字，不要有Markdown格式。"
-            
-            response = client.models.generate_content(
+    indices = sorted(file_refs)
+    contents = []
+    for i in indices:
+        contents += [f"第 {i+1} 張投影片：", file_refs[i]]
+    contents.append(BATCH_PROMPT.format(count=len(indices)))
+
+    response = await client.aio.models.generate_content(
+        model=GEMINI_MODEL_NAME,
+        contents=contents,
+        config=types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=list[str]
+        )
+    )
+
+    batch = json.loads(response.text)
+    if not isinstance(batch, list) or len(batch) != len(indices) or not all(isinstance(t, str) for t in batch):
+        raise ValueError(f"講稿數量不符 (預期 {len(indices)} 份)")
+    return dict(zip(indices, batch))
+
+async def generate_scripts_each(client, file_refs, semaphore):
+    """
+    逐頁生成講稿 (同時送出，以 Semaphore 限制同時請求數量)
+    批次結果無法使用時的備援方式，回傳 {投影片 index: 講稿或 Exception}
+    """
+    async def process_slide(i):
+        async with semaphore:
+            print(f"   分析第 {i+1} 頁...")
+            response = await client.aio.models.generate_content(
                 model=GEMINI_MODEL_NAME,
-                contents=[file_ref, prompt]
+                contents=[file_refs[i], SLIDE_PROMPT]
             )
-            
-            if response.text:
-                text_content = response.text.strip()
-                scripts.append(text_content)
-                # print(f"   -> 生成內容: {text_content[:20]}...")
+        return response.text
+
+    indices = sorted(file_refs)
+    results = await asyncio.gather(*[process_slide(i) for i in indices], return_exceptions=True)
+    return dict(zip(indices, results))
+
+async def generate_scripts_async(image_paths):
+    """
+    【更新版】使用 google-genai (v1.0+) 新版 SDK 的非同步介面 (client.aio)
+    1. 內容未變的投影片直接沿用快取講稿
+    2. 其餘投影片同時上傳，並以 Semaphore 限制同時請求數量，避免觸發速率限制
+    3. 所有圖片在同一個請求中一次生成講稿；若失敗則改為逐頁生成
+    """
+    print(f" [2/5] Gemini ({GEMINI_MODEL_NAME}) 正在看圖說故事...")
+    
+    client = get_client()
+    semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+    cache = diskcache.Cache(SCRIPT_CACHE_DIR)
+
+    try:
+        # 0. 檢查快取 (同一張投影片重跑時，略過上傳與生成)
+        # 講稿可能來自批次或逐頁 Prompt，兩者都納入 key，修改任一個都會重新生成
+        keys = [script_cache_key(p, SLIDE_PROMPT + BATCH_PROMPT) for p in image_paths]
+        scripts = [cache.get(key) for key in keys]
+        for i, script in enumerate(scripts):
+            if script is not None:
+                print(f"   第 {i+1} 頁使用快取講稿")
+        pending = [i for i, script in enumerate(scripts) if script is None]
+        if not pending:
+            return scripts
+
+        # 1. 上傳檔案 (新版 SDK 直接上傳，通常無需長時間等待處理)
+        async def upload_slide(i):
+            async with semaphore:
+                print(f"   上傳第 {i+1} 頁...")
+                return await client.aio.files.upload(
+                    file=image_paths[i],
+                    config={'display_name': f"Slide_{i}"}
+                )
+
+        uploads = await asyncio.gather(*[upload_slide(i) for i in pending], return_exceptions=True)
+        file_refs = {}
+        results = {}
+        for i, upload in zip(pending, uploads):
+            if isinstance(upload, Exception):
+                results[i] = upload
             else:
-                scripts.append("（無法生成文字內容）")
-                
-        except Exception as e:
-            print(f"   Gemini 生成錯誤: {e}")
-            scripts.append(f"第 {i+1} 頁內容生成失敗，請手動補充。")
+                file_refs[i] = upload
+
+        # 2. 生成內容 (一次請求取得全部講稿)
+        if file_refs:
+            print(f"   一次分析 {len(file_refs)} 頁...")
+            try:
+                results.update(await generate_scripts_batch(client, file_refs))
+            except Exception as e:
+                print(f"   批次生成失敗 ({e})，改為逐頁生成...")
+                results.update(await generate_scripts_each(client, file_refs, semaphore))
+
+        for i in pending:
+            result = results[i]
+            if isinstance(result, Exception):
+                print(f"   第 {i+1} 頁 Gemini 生成錯誤: {result}")
+                scripts[i] = f"第 {i+1} 頁內容生成失敗，請手動補充。"
+            elif result and result.strip():
+                scripts[i] = result.strip()
+                cache.set(keys[i], scripts[i])
+            else:
+                scripts[i] = "（無法生成文字內容）"
+    finally:
+        cache.close()
             
     return scripts
 
+def script_cache_key(img_path, prompt):
+    """
+    以「圖片內容 + 模型名稱 + Prompt」的 SHA-256 作為講稿快取 key
+    投影片內容沒變就直接沿用上次的講稿；換模型或修改 Prompt 則會重新生成
+    """
+    h = hashlib.sha256()
+    with open(img_path, "rb") as f:
+        h.update(f.read())
+    h.update(GEMINI_MODEL_NAME.encode("utf-8"))
+    h.update(prompt.encode("utf-8"))
+    return h.hexdigest()
+
 def upload_to_heygen(file_path):
     headers = {
         "X-Api-Key": HEYGEN_API_KEY,
@@ -153,15 +287,14 @@ def upload_to_heygen(file_path):
 
     print(f"    正在上傳背景: {file_path}")
 
+    # 直接傳入檔案物件，requests 會從磁碟分段送出，不需先把整張圖片讀進記憶體
     with open(file_path, "rb") as f:
-        file_data = f.read()
-        
-    response = requests.post(
-        UPLOAD_URL_V1, 
-        headers=headers, 
-        data=file_data, 
-        params={"type": "image"}
-    )
+        response = SESSION.post(
+            UPLOAD_URL_V1, 
+            headers=headers, 
+            data=f, 
+            params={"type": "image"}
+        )
     
     if response.status_code == 200:
         return response.json()["data"]["id"]
@@ -171,11 +304,12 @@ def upload_to_heygen(file_path):
 def create_full_video(image_paths, scripts):
     print(" [3/5] 建立影片任務 (Talking Photo 模式)...")
     
+    # 使用 ThreadPool 平行上傳背景圖片 (executor.map 會保留輸入順序)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        bg_ids = list(executor.map(upload_to_heygen, image_paths))
+
     scenes = []
-    for i, (img_path, script) in enumerate(zip(image_paths, scripts)):
-        print(f"   正在上傳第 {i+1} 頁背景...")
-        bg_asset_id = upload_to_heygen(img_path)
-        
+    for bg_asset_id, script in zip(bg_ids, scripts):
         voice_id = detect_voice_id(script)
         
         scene = {
@@ -214,7 +348,7 @@ def create_full_video(image_paths, scripts):
         "dimension": {"width": 1280, "height": 720}
     }
 
-    response = requests.post(GENERATE_URL_V2, json=payload, headers=headers)
+    response = SESSION.post(GENERATE_URL_V2, json=payload, headers=headers)
     data = response.json()
     
     if response.status_code == 200 and not data.get("error"):
@@ -224,33 +358,38 @@ def create_full_video(image_paths, scripts):
     else:
         raise Exception(f"HeyGen 任務失敗: {data}")
 
-# === ASS 時間解析工具 ===
-def parse_ass_time(time_str):
+# === ASS 時間解析工具 (全部以整數毫秒計算，不建立 datetime 物件) ===
+def parse_ass_ms(time_str):
+    """
+    將 ASS 時間 (H:MM:SS.cc) 轉為毫秒整數，格式錯誤時回傳 0
+    """
     try:
-        parts = time_str.split(':')
-        h = int(parts[0])
-        m = int(parts[1])
-        s_parts = parts[2].split('.')
-        s = int(s_parts[0])
-        cs = int(s_parts[1]) # centiseconds
-        return datetime(1900, 1, 1, h, m, s) + timedelta(milliseconds=cs*10)
+        h, m, rest = time_str.split(':')
+        sec, cs = rest.split('.')  # cs = centiseconds
+        return ((int(h) * 60 + int(m)) * 60 + int(sec)) * 1000 + int(cs) * 10
     except Exception:
-        return datetime(1900, 1, 1, 0, 0, 0)
+        return 0
+
+def format_srt_time(ms):
+    """
+    將毫秒整數轉為 SRT 時間格式 (HH:MM:SS,mmm)
+    """
+    return f"{ms // 3600000:02}:{(ms // 60000) % 60:02}:{(ms // 1000) % 60:02},{ms % 1000:03}"
 
 # === ASS 轉 SRT 核心函數 ===
 def convert_ass_to_srt(input_path, offset_seconds=-1.0):
     print(f"    正在偵測格式並執行轉換 (時間位移 {offset_seconds} 秒)...")
     
-    content = ""
-    try:
-        with open(input_path, "r", encoding="utf-8-sig") as f:
-            content = f.read()
-    except:
-        with open(input_path, "r", encoding="utf-8") as f:
-            content = f.read()
+    # 只讀取一次：若開頭有 UTF-8 BOM 就去掉，再以 UTF-8 解碼
+    with open(input_path, "rb") as f:
+        raw = f.read()
+    if raw.startswith(b"\xef\xbb\xbf"):
+        raw = raw[3:]
+    content = raw.decode("utf-8", errors="replace")
 
     lines = content.splitlines()
     srt_events = []
+    offset_ms = int(round(offset_seconds * 1000))
     
     # 解析 ASS 內容
     for line in lines:
@@ -263,22 +402,15 @@ def convert_ass_to_srt(input_path, offset_seconds=-1.0):
                 end_str = parts[2].strip()
                 text = parts[9].strip()
 
-                start_dt = parse_ass_time(start_str)
-                end_dt = parse_ass_time(end_str)
-                
-                delta = timedelta(seconds=offset_seconds)
-                new_start = start_dt + delta
-                new_end = end_dt + delta
-
-                base_time = datetime(1900, 1, 1, 0, 0, 0)
-                if new_start < base_time: new_start = base_time
-                if new_end < base_time: new_end = base_time
+                # 套用時間位移，且不可小於 0
+                start_ms = max(parse_ass_ms(start_str) + offset_ms, 0)
+                end_ms = max(parse_ass_ms(end_str) + offset_ms, 0)
 
                 text = text.replace(r'\n', '\n').replace(r'\N', '\n')
 
                 srt_events.append({
-                    "start": new_start,
-                    "end": new_end,
+                    "start_ms": start_ms,
+                    "end_ms": end_ms,
                     "text": text
                 })
             except Exception as e:
@@ -288,83 +420,123 @@ def convert_ass_to_srt(input_path, offset_seconds=-1.0):
         print("    未偵測到 ASS 格式，無法轉換。")
         return 
 
-    # 覆蓋原檔案為標準 SRT
+    # 先在記憶體組好完整 SRT 內容，再一次寫入覆蓋原檔案
+    blocks = []
+    for idx, event in enumerate(srt_events, 1):
+        start_fmt = format_srt_time(event['start_ms'])
+        end_fmt = format_srt_time(event['end_ms'])
+        blocks.append(f"{idx}\r\n{start_fmt} --> {end_fmt}\r\n{event['text']}\r\n\r\n")
+
     with open(input_path, "w", encoding="utf-8-sig") as f:
-        for idx, event in enumerate(srt_events, 1):
-            start_fmt = event['start'].strftime("%H:%M:%S,%f")[:-3]
-            end_fmt = event['end'].strftime("%H:%M:%S,%f")[:-3]
-            
-            f.write(f"{idx}\r\n")
-            f.write(f"{start_fmt} --> {end_fmt}\r\n")
-            f.write(f"{event['text']}\r\n\r\n")
+        f.write("".join(blocks))
 
     print(f"    格式轉換完成！已將 ASS 轉為標準 SRT (共 {len(srt_events)} 行)。")
 
 
+def stream_download(url, output_path, chunk_size=1 << 20):
+    """
+    以串流方式下載檔案，邊接收邊寫入磁碟 (每次 1 MiB)，避免整個影片暫存在記憶體中
+    """
+    with SESSION.get(url, stream=True) as r:
+        r.raise_for_status()
+        with open(output_path, "wb") as f:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+    return output_path
+
+def retry_after_seconds(response, default=5):
+    """
+    讀取 HTTP Retry-After 標頭 (秒數)，無法解析時使用預設值
+    """
+    try:
+        return max(int(response.headers.get("Retry-After", default)), 0)
+    except ValueError:
+        return default
+
 def download_video(video_id, output_filename):
     print(f" [4/5] 等待渲染中...")
     headers = {"X-Api-Key": HEYGEN_API_KEY}
     status_url = f"{VIDEO_STATUS_URL_V1}?video_id={video_id}"
     
     start_time = time.time()
+    delay = POLL_INITIAL_DELAY
     while True:
         try:
-            resp = requests.get(status_url, headers=headers)
-            data = resp.json()["data"]
-            status = data["status"]
-            
-            if status == "completed":
-                video_url = data.get("video_url")
-                caption_url = data.get("caption_url")
+            resp = SESSION.get(status_url, headers=headers, timeout=10)
+            resp.raise_for_status()
+            data = resp.json().get("data") or {} # data 為 null 或缺少時視為尚未就緒，繼續輪詢
+            status = data.get("status")
+        except requests.HTTPError as e:
+            # 429 = 觸發速率限制：依照 Retry-After 指示等待後再查詢
+            if e.response.status_code == 429:
+                wait = retry_after_seconds(e.response)
+                print(f"   查詢過於頻繁 (429)，{wait} 秒後重試...")
+                time.sleep(wait)
+                continue
+            # 5xx (連線池已自動重試過) 視為暫時性錯誤，其餘 4xx 為致命錯誤
+            if e.response.status_code >= 500:
+                print(f"   伺服器錯誤: {e}")
+                time.sleep(delay)
+                continue
+            raise
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.RetryError, ValueError) as e:
+            # 網路中斷、逾時或回應不是 JSON：稍候再試
+            print(f"   連線錯誤: {e}")
+            time.sleep(delay)
+            continue
+
+        if status == "completed":
+            video_url = data.get("video_url")
+            caption_url = data.get("caption_url")
+
+            # 影片與字幕是兩個獨立的下載：字幕交給背景執行緒，與影片下載同時進行
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                caption_future = executor.submit(SESSION.get, caption_url) if caption_url else None
 
                 print("    下載影片中...")
                 if video_url:
-                    content = requests.get(video_url).content
-                    with open(output_filename, "wb") as f:
-                        f.write(content)
+                    stream_download(video_url, output_filename)
                     print(f"    影片已儲存: {output_filename}")
 
-                # === 字幕下載與處理區塊 ===
-                if caption_url:
-                    print("    發現字幕，正在下載...")
-                    try:
-                        sub_resp = requests.get(caption_url)
-                        sub_resp.encoding = 'utf-8'
-                        content_text = sub_resp.text.strip()
-
-                        if content_text.startswith("WEBVTT"):
-                            print("    字幕為 VTT 格式，存為 .vtt")
-                            vtt_filename = os.path.splitext(output_filename)[0] + ".vtt"
-                            with open(vtt_filename, "w", encoding="utf-8") as f:
-                                f.write(content_text)
-                        else:
-                            # 預設存為 SRT
-                            srt_filename = os.path.splitext(output_filename)[0] + ".srt"
-                            # 先存一次原始檔
-                            with open(srt_filename, "w", encoding="utf-8-sig") as f:
-                                f.write(content_text)
-                            
-                            # 呼叫 ASS 轉換與時間修正 (修正 -1.3 秒)
-                            convert_ass_to_srt(srt_filename, offset_seconds=-1.3)
-                            
-                    except Exception as e:
-                        print(f"    字幕下載或處理失敗: {e}")
-                else:
-                    print("    此次生成未包含字幕連結")
-                # ==========================
-                break
-
-            elif status == "failed":
-                print(f"    渲染失敗: {data.get('error')}")
-                break
-            
-            elapsed = int(time.time() - start_time)
-            print(f"   狀態: {status} (已耗時 {elapsed}s)...")
-            time.sleep(10)
-            
-        except Exception as e:
-            print(f"   連線錯誤: {e}")
-            time.sleep(10)
+            # === 字幕下載與處理區塊 ===
+            if caption_future:
+                print("    發現字幕，正在處理...")
+                try:
+                    sub_resp = caption_future.result()
+                    sub_resp.encoding = 'utf-8'
+                    content_text = sub_resp.text.strip()
+
+                    if content_text.startswith("WEBVTT"):
+                        print("    字幕為 VTT 格式，存為 .vtt")
+                        vtt_filename = os.path.splitext(output_filename)[0] + ".vtt"
+                        with open(vtt_filename, "w", encoding="utf-8") as f:
+                            f.write(content_text)
+                    else:
+                        # 預設存為 SRT
+                        srt_filename = os.path.splitext(output_filename)[0] + ".srt"
+                        # 先存一次原始檔
+                        with open(srt_filename, "w", encoding="utf-8-sig") as f:
+                            f.write(content_text)
+                        
+                        # 呼叫 ASS 轉換與時間修正 (修正 -1.3 秒)
+                        convert_ass_to_srt(srt_filename, offset_seconds=-1.3)
+                        
+                except Exception as e:
+                    print(f"    字幕下載或處理失敗: {e}")
+            else:
+                print("    此次生成未包含字幕連結")
+            # ==========================
+            break
+
+        elif status == "failed":
+            print(f"    渲染失敗: {data.get('error')}")
+            break
+        
+        elapsed = int(time.time() - start_time)
+        print(f"   狀態: {status} (已耗時 {elapsed}s)...")
+        # 指數退避 + 隨機抖動：短影片能更快偵測完成，長影片也不會過度輪詢
+        time.sleep(delay + random.uniform(0, 0.5))
+        delay = min(delay * POLL_BACKOFF_FACTOR, POLL_MAX_DELAY)
 
 # ================= 3. 主程式執行 =================
 if __name__ == "__main__":
@@ -378,7 +550,7 @@ if __name__ == "__main__":
         slides = convert_pptx_to_images(INPUT_PPTX)
         
         # 2. 生成講稿 (Gemini V1.0 SDK)
-        generated_scripts = generate_scripts(slides)
+        generated_scripts = asyncio.run(generate_scripts_async(slides))
         
         # 3. 建立影片 (HeyGen)
         vid_id = create_full_video(slides, generated_scripts)
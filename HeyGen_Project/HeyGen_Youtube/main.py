@@ -4,23 +4,29 @@ import subprocess
 import requests
 import re
 import json
+import html
+import glob
+import shutil
+import hashlib
+import tempfile
+import zipfile
 import traceback
+import diskcache # YouTube 搜尋結果快取 (磁碟，含過期時間)
 from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry # 用於 5xx 錯誤自動重試
 
 # --- 第三方庫 ---
-import qrcode
+import segno # QR Code 產生器 (直接輸出 PNG，不需經過 PIL)
 from googleapiclient.discovery import build  # 用於與 YouTube 官方 API 互動
 from googleapiclient.errors import HttpError # 用於捕捉 YouTube API 的錯誤
-import isodate  # 用於解析 YouTube 回傳的時間格式 (例如 PT5M30S)
-from moviepy.editor import VideoFileClip, concatenate_videoclips # 用於影片剪輯與合併
 from google import genai
 from google.genai import types
 from pptx import Presentation
 from pptx.util import Pt, Inches
 from pptx.dml.color import RGBColor
-from pdf2image import convert_from_path # 將 PDF 轉為圖片 (需安裝 poppler)
 
 # ================= 1. 環境與參數設定 =================
 
@@ -48,6 +54,12 @@ USER_NAME = "j"
 CHANNEL_NAME = "科技全球焦點" 
 TEMPLATE_PPPTX = "tech_template.pptx" # PPT 模板檔案名稱
 OUTPUT_DIR = "outputs" # 輸出檔案的資料夾
+RENDER_DPI = 200 # 投影片轉圖片的解析度
+YT_CACHE_DIR = os.path.join(OUTPUT_DIR, ".yt_cache") # YouTube 搜尋結果快取位置
+YT_CACHE_TTL = 24 * 3600 # 快取有效時間 (秒)
+YT_CACHE_DISABLED = os.getenv("YT_NO_CACHE") == "1" # 設定 YT_NO_CACHE=1 可強制重新搜尋
+SLIDE_CACHE_DIR = os.path.join(OUTPUT_DIR, ".slide_cache") # 投影片圖片快取位置 (依 PPTX 內容雜湊分資料夾)
+SLIDE_CACHE_MAX_DECKS = 3 # 最多保留幾份簡報的圖片，超過時刪除最久未使用的
 
 # --- HeyGen API 參數 ---
 API_HOST = "https://api.heygen.com"
@@ -55,6 +67,16 @@ GENERATE_URL_V2 = f"{API_HOST}/v2/video/generate" # 影片生成端點
 UPLOAD_URL_V1 = "https://upload.heygen.com/v1/asset" # 資源上傳端點
 VIDEO_STATUS_URL_V1 = f"{API_HOST}/v1/video_status.get" # 狀態查詢端點
 
+# --- HTTP 連線池 ---
+# 所有 HeyGen 請求共用同一個 Session，重複使用 keep-alive 連線 (省去每次的 TLS 握手)
+# 遇到 5xx 伺服器錯誤時自動重試 3 次
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504])
+))
+
 # --- 數字人與聲音設定 (需替換為您自己的 HeyGen ID) ---
 TALKING_PHOTO_ID = "8c6187262e744939bb335949024e3ec5" # 數字人像 ID
 VOICE_ID_ZH = "4158cf2ef85d4ccc856aacb1c47dbb0c" # 中文語音 ID
@@ -64,21 +86,67 @@ VOICE_ID_EN = "cef3bc4e0a84424cafcde6f2cf466c97" # 英文語音 ID (備用)
 # 1.0 = 原速, 1.1 = 稍快(推薦新聞感), 1.2 = 快, 0.9 = 慢
 VOICE_SPEED = 1.1  
 
+# --- PPT 排版樣式 (預先建立，迴圈內直接重複使用) ---
+NEWS_FONT_SIZE = Pt(24)            # 頻道名稱與新聞標題字體大小
+NEWS_SPACE_AFTER = Pt(20)          # 新聞段落間距
+CHANNEL_COLOR = RGBColor(255, 215, 0) # 頻道名稱：金黃色
+QR_TITLE_FONT_SIZE = Pt(28)        # QR Code 結尾頁標題字體大小
+QR_TITLE_COLOR = RGBColor(255, 0, 0)
+LINK_FONT_SIZE = Pt(16)            # 連結文字字體大小
+LINK_COLOR = RGBColor(5, 99, 193)  # 連結文字：超連結藍
+
+# --- 渲染狀態輪詢設定 ---
+# 輪詢間隔依 Fibonacci 遞增：2, 3, 5, 8, 13 秒...，最長 20 秒
+POLL_MAX_DELAY = 20
+
+# --- 片頭重新編碼設定 ---
+# x264 預設 preset 為 medium；片頭只轉一次且長度短，veryfast 速度約快 3 倍，檔案僅略大
+X264_PRESET = "veryfast"
+
 # --- 外部軟體路徑 ---
 # LibreOffice 用於將 PPTX 轉為 PDF，請確保此路徑正確
 WINDOWS_SOFFICE_PATH = r"C:\Program Files\LibreOffice\program\soffice.exe"
+# 啟動時解析一次實際使用的執行檔，之後轉檔不再重複檢查路徑
+SOFFICE_BIN = WINDOWS_SOFFICE_PATH if os.path.exists(WINDOWS_SOFFICE_PATH) else (shutil.which("soffice") or "soffice")
+# (選用) 常駐的 unoserver：先以 `unoserver --port 2003` 啟動並設定 UNOSERVER_PORT，
+# 轉檔時改用 unoconvert 連線，省去每次冷啟動 LibreOffice 的 1~3 秒；未設定則照舊呼叫 soffice
+UNOSERVER_HOST = os.getenv("UNOSERVER_HOST", "127.0.0.1")
+UNOSERVER_PORT = os.getenv("UNOSERVER_PORT")
+UNOCONVERT_BIN = shutil.which("unoconvert") if UNOSERVER_PORT else None
 
 # ================= 2. 工具函數 =================
 
+# 中文字元偵測 (用於選擇語音)，預先編譯
+_CJK_RE = re.compile(r"[\u4e00-\u9fff]")
+
+# Gemini 回傳中最外層的 [ {...} ] 陣列，預先編譯
+_JSON_ARRAY_RE = re.compile(r'\[\s*\{.*\}\s*\]', re.DOTALL)
+
+# YouTube 回傳的 ISO 8601 影片長度 (例如 PT5M30S、P1DT2H)，預先編譯
+_ISO_DURATION_RE = re.compile(r"P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?")
+
+def parse_duration_seconds(duration_iso):
+    """
+    將 ISO 8601 影片長度轉為秒數 (整數)，無法解析時回傳 0。
+    """
+    match = _ISO_DURATION_RE.fullmatch(duration_iso or "")
+    if not match:
+        return 0
+    d, h, m, s = (int(x) if x else 0 for x in match.groups())
+    return ((d * 24 + h) * 60 + m) * 60 + s
+
 def safe_extract_json(text):
     """
     從 LLM (Gemini) 回傳的文字中提取 JSON 部分。
     處理包含 ```json ... ``` 標籤的情況。
     """
     if not text: return None
-    match = re.search(r'```json\s*(.*?)\s*```', text, re.DOTALL)
-    if match: return match.group(1)
-    match = re.search(r'\[\s*\{.*\}\s*\]', text, re.DOTALL)
+    # 先找 ```json 包裹的內容 (用 str.find 直接定位，不需 regex 回溯)
+    start = text.find("```json")
+    if start != -1:
+        end = text.find("```", start + 7)
+        if end != -1: return text[start + 7:end].strip()
+    match = _JSON_ARRAY_RE.search(text)
     if match: return match.group(0)
     return text.strip()
 
@@ -96,27 +164,28 @@ def generate_qr_code(url, output_path):
     """
     將網址轉換為 QR Code 圖片並存檔。
     """
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=2,
-    )
-    qr.add_data(url)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    img.save(output_path)
+    qr = segno.make_qr(url, error="l") # make_qr：一律產生標準 QR Code (不使用 Micro QR)
+    qr.save(output_path, scale=10, border=2, dark="black", light="white")
     return output_path
 
 # --- [關鍵功能] 使用 YouTube Data API 搜尋影片 ---
 
-def search_youtube_via_api(topic, limit=5):
+def search_youtube_via_api(topic, current_date_str, limit=5):
     """
     使用官方 YouTube Data API 搜尋影片。
     流程：
     1. Search API: 找關鍵字相關的最新影片 ID
     2. Videos API: 根據 ID 查詢詳細資訊 (為了過濾 Shorts 和確認時間)
+    兩次呼叫約耗 100+ 配額單位，因此以 (主題, 日期, 數量) 為 key 在磁碟快取 24 小時。
     """
+    cache_key = f"{topic}|{current_date_str}|{limit}"
+    if not YT_CACHE_DISABLED:
+        with diskcache.Cache(YT_CACHE_DIR) as cache:
+            cached = cache.get(cache_key)
+        if cached is not None:
+            print(f" [API 搜尋] 使用快取的搜尋結果：{topic} (共 {len(cached)} 部影片)")
+            return cached
+
     print(f" [API 搜尋] 正在搜尋：{topic} (啟用 Shorts 過濾)...")
     
     real_data = []
@@ -148,23 +217,23 @@ def search_youtube_via_api(topic, limit=5):
         for item in videos_response.get('items', []):
             if count >= limit: break
 
+            snippet = item['snippet']
+
             # 解析影片長度 (格式如 PT5M30S)
-            duration_iso = item['contentDetails']['duration']
-            duration_obj = isodate.parse_duration(duration_iso)
+            duration_secs = parse_duration_seconds(item['contentDetails']['duration'])
             
             # 過濾 Shorts: 長度小於 60 秒視為 Shorts，跳過不處理
-            if duration_obj.total_seconds() < 60:
-                # print(f"    -> 跳過 Shorts: {item['snippet']['title']} ({duration_obj})")
+            if duration_secs < 60:
+                # print(f"    -> 跳過 Shorts: {snippet['title']} ({duration_secs}s)")
                 continue
 
             # 提取需要的資料
-            title = item['snippet']['title']
-            channel = item['snippet']['channelTitle']
+            title = snippet['title']
+            channel = snippet['channelTitle']
             video_id = item['id']
             url = f"https://www.youtube.com/watch?v={video_id}"
             
             # 簡單清洗標題 (移除 HTML 實體符號，例如 &amp;)
-            import html
             title = html.unescape(title)
 
             real_data.append({
@@ -173,9 +242,14 @@ def search_youtube_via_api(topic, limit=5):
                 "url": url
             })
             
-            print(f"    -> [V] 納入: {title[:15]}... ({str(duration_obj)})")
+            print(f"    -> [V] 納入: {title[:15]}... ({timedelta(seconds=duration_secs)})")
             count += 1
-            
+
+        # 只快取有結果的搜尋，避免把暫時性的空結果保存一整天
+        if real_data:
+            with diskcache.Cache(YT_CACHE_DIR) as cache:
+                cache.set(cache_key, real_data, expire=YT_CACHE_TTL)
+
         return real_data
 
     except HttpError as e:
@@ -198,7 +272,7 @@ def fetch_content_and_make_pptx(topic, intro_script):
     current_date_str = now.strftime('%Y-%m-%d')
     
     # 步驟 1: 獲取真實資料
-    real_videos = search_youtube_via_api(topic, limit=5)
+    real_videos = search_youtube_via_api(topic, current_date_str, limit=5)
     
     # 若 API 失敗或無資料，使用備用假資料 (避免程式崩潰)
     if not real_videos:
@@ -275,10 +349,11 @@ def fetch_content_and_make_pptx(topic, intro_script):
     ITEMS_PER_PAGE = 3 
     chunks = [final_data[i:i + ITEMS_PER_PAGE] for i in range(0, len(final_data), ITEMS_PER_PAGE)]
 
+    # 選擇投影片版型 (如果有第二種版型則使用，否則用第一種)，所有新聞頁共用
+    news_layout = prs.slide_layouts[1 if len(prs.slide_layouts) > 1 else 0]
+
     for i, chunk in enumerate(chunks):
-        # 選擇投影片版型 (如果有第二種版型則使用，否則用第一種)
-        layout_idx = 1 if len(prs.slide_layouts) > 1 else 0
-        slide = prs.slides.add_slide(prs.slide_layouts[layout_idx]) 
+        slide = prs.slides.add_slide(news_layout)
         
         if slide.shapes.title:
             slide.shapes.title.text = "熱門影片推薦"
@@ -307,19 +382,19 @@ def fetch_content_and_make_pptx(topic, intro_script):
 
             # [PPT 排版細節]
             p = tf.add_paragraph()
-            p.space_after = Pt(20) 
+            p.space_after = NEWS_SPACE_AFTER
 
             # 頻道名稱：金色、粗體、大字
             run_channel = p.add_run()
             run_channel.text = f"【{news_channel}】" 
-            run_channel.font.size = Pt(24)
+            run_channel.font.size = NEWS_FONT_SIZE
             run_channel.font.bold = True
-            run_channel.font.color.rgb = RGBColor(255, 215, 0) # 金黃色
+            run_channel.font.color.rgb = CHANNEL_COLOR
 
             # 新聞標題
             run_text = p.add_run()
             run_text.text = f" {news_highlight}"
-            run_text.font.size = Pt(24)
+            run_text.font.size = NEWS_FONT_SIZE
             # run_text.font.color.rgb = RGBColor(255, 255, 255) # 若背景深色，可開啟此行
 
         # 組合口播稿
@@ -351,9 +426,9 @@ def fetch_content_and_make_pptx(topic, intro_script):
         title_tf = title_box.text_frame
         title_p = title_tf.add_paragraph()
         title_p.text = "影片來源列表 (掃描 QR Code 觀看)"
-        title_p.font.size = Pt(28)
+        title_p.font.size = QR_TITLE_FONT_SIZE
         title_p.font.bold = True
-        title_p.font.color.rgb = RGBColor(255, 0, 0) 
+        title_p.font.color.rgb = QR_TITLE_COLOR
 
         # 設定 QR Code 的起始位置與間距
         start_y = Inches(1.3)
@@ -362,36 +437,34 @@ def fetch_content_and_make_pptx(topic, intro_script):
         qr_x = Inches(0.8)
         text_x = Inches(2.0)
         
-        temp_qr_files = [] 
-
         # 迴圈生成 QR Code 圖片並貼到 PPT 上 (最多顯示前 5 個)
-        for i, url in enumerate(all_collected_urls[:5]):
-            current_y = start_y + (i * y_offset)
+        # 圖片在 add_picture 時就已複製進 PPTX，因此暫存目錄離開 with 區塊即可整個刪除
+        with tempfile.TemporaryDirectory() as qr_tmp:
+            for i, url in enumerate(all_collected_urls[:5]):
+                current_y = start_y + (i * y_offset)
             
-            qr_filename = f"temp_qr_{i}.png"
-            qr_path = os.path.join(OUTPUT_DIR, qr_filename)
-            generate_qr_code(url, qr_path)
-            temp_qr_files.append(qr_path)
-
-            # 貼上圖片
-            last_slide.shapes.add_picture(qr_path, qr_x, current_y, width=qr_size, height=qr_size)
-
-            # 貼上文字連結
-            url_box = last_slide.shapes.add_textbox(text_x, current_y + Inches(0.1), Inches(10.5), Inches(0.8))
-            url_tf = url_box.text_frame
-            url_tf.word_wrap = True
+                qr_path = os.path.join(qr_tmp, f"qr_{i}.png")
+                generate_qr_code(url, qr_path)
+
+                # 貼上圖片
+                last_slide.shapes.add_picture(qr_path, qr_x, current_y, width=qr_size, height=qr_size)
+
+                # 貼上文字連結
+                url_box = last_slide.shapes.add_textbox(text_x, current_y + Inches(0.1), Inches(10.5), Inches(0.8))
+                url_tf = url_box.text_frame
+                url_tf.word_wrap = True
             
-            url_p = url_tf.add_paragraph()
-            display_text = url if len(url) < 80 else url[:77] + "..."
+                url_p = url_tf.add_paragraph()
+                display_text = url if len(url) < 80 else url[:77] + "..."
             
-            run = url_p.add_run()
-            run.text = f"[{i+1}] {display_text}"
-            run.font.size = Pt(16)
-            run.font.color.rgb = RGBColor(5, 99, 193)
-            run.font.underline = True
-            try:
-                run.hyperlink.address = url
-            except ValueError: pass
+                run = url_p.add_run()
+                run.text = f"[{i+1}] {display_text}"
+                run.font.size = LINK_FONT_SIZE
+                run.font.color.rgb = LINK_COLOR
+                run.font.underline = True
+                try:
+                    run.hyperlink.address = url
+                except ValueError: pass
 
         final_scripts.append("您可以掃描畫面上的 QR Code，或是點擊連結觀看完整影片。感謝您的收看，我們下次見！")
 
@@ -399,39 +472,132 @@ def fetch_content_and_make_pptx(topic, intro_script):
     pptx_path = os.path.join(OUTPUT_DIR, "final_gen.pptx")
     prs.save(pptx_path)
 
-    # 清除暫存的 QR Code 圖片
-    for qr_file in temp_qr_files:
-        try: os.remove(qr_file)
-        except: pass
-
     return pptx_path, final_scripts
 
 # ================= 4. 圖片轉換與影片生成 =================
 
+def get_pdf_page_count(pdf_path):
+    """
+    使用 Poppler 的 pdfinfo 取得 PDF 總頁數。
+    """
+    result = subprocess.run(["pdfinfo", pdf_path], check=True, capture_output=True, text=True)
+    match = re.search(r"^Pages:\s+(\d+)", result.stdout, re.MULTILINE)
+    if not match:
+        raise Exception(f"無法讀取 PDF 頁數: {pdf_path}")
+    return int(match.group(1))
+
+def convert_to_pdf(path):
+    """
+    將 PPT/PPTX 轉為 PDF，輸出至 OUTPUT_DIR 並回傳 PDF 路徑。
+    有設定 unoserver 時優先交給常駐的 LibreOffice 處理，失敗則退回直接呼叫 soffice。
+    """
+    pdf_path = os.path.join(OUTPUT_DIR, os.path.splitext(os.path.basename(path))[0] + ".pdf")
+    if UNOCONVERT_BIN:
+        try:
+            subprocess.run([UNOCONVERT_BIN, "--host", UNOSERVER_HOST, "--port", UNOSERVER_PORT,
+                            "--convert-to", "pdf", path, pdf_path], check=True, timeout=120)
+            return pdf_path
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            print(f"    unoserver 轉檔失敗，改用 soffice: {e}")
+
+    subprocess.run([SOFFICE_BIN, "--headless", "--convert-to", "pdf", path, "--outdir", OUTPUT_DIR], check=True)
+    return pdf_path
+
+def render_pdf_pages(pdf_path, prefix, first_page, last_page):
+    """
+    呼叫 pdftoppm 將指定頁碼範圍直接輸出為 PNG (檔名格式：prefix-頁碼.png)。
+    """
+    subprocess.run([
+        "pdftoppm", "-png", "-r", str(RENDER_DPI),
+        "-f", str(first_page), "-l", str(last_page),
+        pdf_path, prefix
+    ], check=True)
+
+def pptx_content_hash(path):
+    """
+    計算 PPTX 的內容雜湊，作為投影片圖片快取的 key。
+    python-pptx 每次存檔都會寫入新的 zip 時間戳記，因此改為雜湊各成員的名稱與解壓後內容，
+    內容相同的簡報就會得到相同的 key。轉圖解析度也納入 key。
+    """
+    digest = hashlib.sha256(f"dpi={RENDER_DPI}".encode("utf-8"))
+    with zipfile.ZipFile(path) as zf:
+        for name in sorted(zf.namelist()):
+            digest.update(name.encode("utf-8"))
+            digest.update(zf.read(name))
+    return digest.hexdigest()
+
+def slide_page_number(png_path):
+    """從 pdftoppm 輸出檔名 (slide-01.png) 取出頁碼。"""
+    return int(os.path.splitext(os.path.basename(png_path))[0].rsplit("-", 1)[1])
+
+def prune_slide_cache(current_dir):
+    """
+    只保留最近使用的 SLIDE_CACHE_MAX_DECKS 份投影片快取 (含 current_dir)，依資料夾修改時間刪除較舊的。
+    """
+    if not os.path.isdir(SLIDE_CACHE_DIR):
+        return
+    others = [entry.path for entry in os.scandir(SLIDE_CACHE_DIR) if entry.is_dir() and entry.path != current_dir]
+    others.sort(key=os.path.getmtime, reverse=True)
+    for stale in others[SLIDE_CACHE_MAX_DECKS - 1:]:
+        shutil.rmtree(stale, ignore_errors=True)
+
 def convert_pptx_to_images(path):
     """
     將 PPTX 轉為圖片 (PNG) 序列，供 HeyGen 作為背景使用。
-    流程：PPTX -> PDF (LibreOffice) -> PNGs (pdf2image)
+    流程：PPTX -> PDF (LibreOffice) -> PNGs (Poppler pdftoppm 直接輸出 PNG)
+    此函數為 generator：每完成一段頁面就立即 yield (頁碼 index, 圖片路徑)，
+    讓上傳可以與其餘頁面的轉檔同時進行 (順序不保證，請以 index 排序)。
+    圖片直接輸出到 SLIDE_CACHE_DIR 下以 PPTX 內容雜湊命名的資料夾 (只存一份)，
+    內容相同時直接沿用，跳過整個轉檔流程；只保留最近幾份簡報，避免快取無限成長。
     """
-    print(" [2/5] PPT 轉圖片...")
-    soffice = WINDOWS_SOFFICE_PATH if os.path.exists(WINDOWS_SOFFICE_PATH) else "soffice"
+    print(" [2/5] PPT 轉圖片並同步上傳素材...")
+
+    cache_dir = os.path.join(SLIDE_CACHE_DIR, pptx_content_hash(path))
+    done_marker = os.path.join(cache_dir, ".complete") # 全部頁面轉完才建立，沒有此檔代表上次中途失敗
+    if os.path.exists(done_marker):
+        cached_pngs = sorted(glob.glob(os.path.join(cache_dir, "slide-*.png")), key=slide_page_number)
+        print(f"    >>> 使用快取的投影片圖片 (共 {len(cached_pngs)} 頁)")
+        os.utime(cache_dir) # 更新使用時間，避免被當成舊快取刪除
+        for png in cached_pngs:
+            yield slide_page_number(png) - 1, png
+        return
+
+    prune_slide_cache(cache_dir)
     
     # 呼叫 LibreOffice 轉檔指令
     try:
-        subprocess.run([soffice, "--headless", "--convert-to", "pdf", path, "--outdir", OUTPUT_DIR], check=True)
+        pdf_path = convert_to_pdf(path)
     except FileNotFoundError:
         print(" 錯誤：找不到 LibreOffice，請確認路徑或安裝")
         raise
 
-    # 將 PDF 轉為圖片
-    pdf_path = os.path.join(OUTPUT_DIR, os.path.basename(path).replace(".pptx", ".pdf"))
-    images = convert_from_path(pdf_path, dpi=200)
-    paths = []
-    for i, img in enumerate(images):
-        p = os.path.join(OUTPUT_DIR, f"slide_{i+1}.png")
-        img.save(p, "PNG")
-        paths.append(p)
-    return paths
+    # 將 PDF 轉為圖片 (先清掉上次中途失敗留下的不完整資料夾)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.makedirs(cache_dir)
+    prefix = os.path.join(cache_dir, "slide")
+
+    # 依 CPU 核心數將頁面切成數段，每段由一個 pdftoppm 行程負責 (-f/-l 指定頁碼範圍)
+    # pdftoppm 直接寫出 PNG，不需再經過 PIL 重新編碼
+    page_count = get_pdf_page_count(pdf_path)
+    if page_count == 0:
+        return
+    workers = max(1, min(os.cpu_count() or 1, page_count))
+    per_worker = -(-page_count // workers) # 無條件進位
+    ranges = [(first, min(first + per_worker - 1, page_count)) for first in range(1, page_count + 1, per_worker)]
+
+    # pdftoppm 輸出檔名為 slide-1.png 或 slide-01.png (依總頁數的位數補零)
+    digits = len(str(page_count))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(render_pdf_pages, pdf_path, prefix, first, last): (first, last) for first, last in ranges}
+        for future in as_completed(futures):
+            future.result()
+            first, last = futures[future]
+            for page in range(first, last + 1):
+                yield page - 1, f"{prefix}-{page:0{digits}d}.png"
+
+    # 全部頁面完成後才標記為可用的快取
+    open(done_marker, "w").close()
 
 def convert_custom_cover(file_path):
     """
@@ -440,17 +606,14 @@ def convert_custom_cover(file_path):
     ext = os.path.splitext(file_path)[1].lower()
     # 如果是 PPT 格式，先轉 PDF
     if ext in [".pptx", ".ppt"]:
-        soffice = WINDOWS_SOFFICE_PATH if os.path.exists(WINDOWS_SOFFICE_PATH) else "soffice"
-        subprocess.run([soffice, "--headless", "--convert-to", "pdf", file_path, "--outdir", OUTPUT_DIR], check=True)
-        file_path = os.path.join(OUTPUT_DIR, os.path.basename(file_path).rsplit('.', 1)[0] + ".pdf")
+        file_path = convert_to_pdf(file_path)
         ext = ".pdf"
     # 如果是 PDF，取第一頁轉圖片
     if ext == ".pdf":
-        images = convert_from_path(file_path, dpi=200, first_page=1, last_page=1)
-        if images:
-            save_path = os.path.join(OUTPUT_DIR, "custom_cover_final.png")
-            images[0].save(save_path, "PNG")
-            return save_path
+        prefix = os.path.join(OUTPUT_DIR, "custom_cover_final")
+        # -singlefile：只輸出一張圖片，檔名不加頁碼 (custom_cover_final.png)
+        subprocess.run(["pdftoppm", "-png", "-r", str(RENDER_DPI), "-f", "1", "-l", "1", "-singlefile", file_path, prefix], check=True)
+        return prefix + ".png"
     return file_path
 
 # --- 上傳圖片到 HeyGen ---
@@ -461,7 +624,7 @@ def upload_to_heygen(file_path):
     headers = {"X-Api-Key": HEYGEN_API_KEY, "Content-Type": "image/png"}
     try:
         with open(file_path, "rb") as f: data = f.read()
-        resp = requests.post(UPLOAD_URL_V1, headers=headers, data=data, params={"type": "image"})
+        resp = SESSION.post(UPLOAD_URL_V1, headers=headers, data=data, params={"type": "image"})
         
         if not resp.ok:
             print(f"\n    [HeyGen 上傳失敗] 狀態碼: {resp.status_code}")
@@ -473,22 +636,41 @@ def upload_to_heygen(file_path):
         print(f"\n    [上傳異常]: {e}")
         raise
 
+# --- 邊轉檔邊上傳 ---
+def upload_slides(slide_images, cover_path=None):
+    """
+    邊轉檔邊上傳：slide_images 每產生一張圖片 (index, path)，就立即交給上傳執行緒，
+    讓上傳與其餘頁面的轉檔同時進行。若有自定義封面，則以封面取代第一張投影片。
+    回傳依頁序排列的 asset_id 列表。
+    """
+    # 使用多執行緒同時上傳多張投影片圖片，加速流程
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        futures = {}
+        if cover_path:
+            futures[executor.submit(upload_to_heygen, cover_path)] = 0
+        for i, path in slide_images:
+            if i == 0 and cover_path: continue # 第一張已由自定義封面取代
+            futures[executor.submit(upload_to_heygen, path)] = i
+
+        bg_ids = {}
+        for future in as_completed(futures):
+            bg_ids[futures[future]] = future.result()
+
+    return [bg_ids[i] for i in sorted(bg_ids)]
+
 # --- 影片生成 ---
-def create_full_video(image_paths, scripts):
+def create_full_video(bg_ids, scripts):
     """
     發送請求給 HeyGen 生成影片。
-    包含：背景圖、數字人 ID、講稿、語速。
+    包含：背景圖 (已上傳的 asset_id，依頁序排列)、數字人 ID、講稿、語速。
     """
     print(f" [3/5] 生成 HeyGen 影片中...")
-    # 使用多執行緒同時上傳多張投影片圖片，加速流程
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        bg_ids = list(executor.map(upload_to_heygen, image_paths))
     
     scenes = []
     # 組合每一頁的場景 (Scene)
     for bg_id, script in zip(bg_ids, scripts):
         # 自動判斷語言 (如果有中文字就用中文語音，否則用英文)
-        v_id = VOICE_ID_ZH if re.search(r"[\u4e00-\u9fff]", script) else VOICE_ID_EN
+        v_id = VOICE_ID_ZH if _CJK_RE.search(script) else VOICE_ID_EN
         scenes.append({
             "character": {
                 "type": "talking_photo", 
@@ -511,7 +693,7 @@ def create_full_video(image_paths, scripts):
 
     payload = {"video_inputs": scenes, "aspect_ratio": "16:9", "test": False, "caption": False}
     
-    resp = requests.post(GENERATE_URL_V2, json=payload, headers={"X-Api-Key": HEYGEN_API_KEY})
+    resp = SESSION.post(GENERATE_URL_V2, json=payload, headers={"X-Api-Key": HEYGEN_API_KEY})
     
     if not resp.ok:
         print(f"\n    [HeyGen 生成失敗] 狀態碼: {resp.status_code}")
@@ -520,55 +702,155 @@ def create_full_video(image_paths, scripts):
 
     return resp.json()["data"]["video_id"]
 
+def stream_download(url, output_path, chunk_size=1 << 20):
+    """
+    以串流方式下載檔案，邊接收邊寫入磁碟 (每次 1 MiB)，避免整支影片暫存在記憶體中。
+    """
+    with SESSION.get(url, stream=True, timeout=60) as r:
+        r.raise_for_status()
+        # 伺服器若有壓縮 (Content-Encoding) 才解壓，一般 MP4 不會壓縮，等同直接複製位元組
+        r.raw.decode_content = True
+        with open(output_path, "wb") as f:
+            shutil.copyfileobj(r.raw, f, length=chunk_size)
+    return output_path
+
+def fib_backoff(first=2, second=3, cap=POLL_MAX_DELAY):
+    """
+    產生輪詢等待秒數 (Fibonacci 遞增，上限 cap 秒)。
+    影片剛完成時能很快偵測到，長時間渲染也不會過度查詢。
+    """
+    a, b = first, second
+    while True:
+        yield min(a, cap)
+        a, b = b, a + b
+
 def download_video(video_id, output_video_path):
     """
     輪詢 (Polling) HeyGen 狀態，直到影片渲染完成並下載。
     """
     print(" [4/5] 等待 HeyGen 渲染...")
     headers = {"X-Api-Key": HEYGEN_API_KEY}
+    # 查詢網址在迴圈外組好一次即可
+    status_url = f"{VIDEO_STATUS_URL_V1}?video_id={video_id}"
     start_time = time.time()
+    delays = fib_backoff()
     
     while True:
         try:
-            r = requests.get(f"{VIDEO_STATUS_URL_V1}?video_id={video_id}", headers=headers).json()
-            data = r.get("data", {})
+            r = SESSION.get(status_url, headers=headers, timeout=10).json()
+            data = r.get("data") or {}
             status = data.get("status")
-        except: time.sleep(5); continue
+        except (requests.RequestException, ValueError): # 網路錯誤或回應不是 JSON，稍後再試
+            time.sleep(next(delays)); continue
         
         if status == "completed":
             print(f"\n    >>> HeyGen 渲染完成！下載中...")
             if data.get("video_url"):
-                with open(output_video_path, "wb") as f: f.write(requests.get(data["video_url"]).content)
+                stream_download(data["video_url"], output_video_path)
             break 
         elif status == "failed": raise Exception(f"渲染失敗: {data.get('error')}")
         
         # 顯示等待時間
         print(f"    ...已等待 {int(time.time()-start_time)} 秒 ({status})", end="\r")
-        time.sleep(15) # 每 15 秒檢查一次
+        time.sleep(next(delays)) # 2, 3, 5, 8, 13, 20, 20... 秒
 
 # ================= 5. 僅合併影片 (無字幕處理) =================
 
+def probe_video(path):
+    """
+    使用 ffprobe 讀取影片的影音格式 (編碼、解析度、影格率、取樣率等)。
+    回傳 {"video": {...}, "audio": {...}}，沒有音軌時 audio 為 None。
+    """
+    result = subprocess.run([
+        "ffprobe", "-v", "error",
+        "-show_entries", "stream=codec_type,codec_name,width,height,pix_fmt,r_frame_rate,time_base,sample_rate,channels",
+        "-of", "json", path
+    ], check=True, capture_output=True, text=True)
+    streams = json.loads(result.stdout).get("streams", [])
+    info = {"video": None, "audio": None}
+    for stream in streams:
+        kind = stream.pop("codec_type", None)
+        if kind in info and info[kind] is None:
+            info[kind] = stream
+    return info
+
+def normalize_intro(intro_video_path, target, output_dir):
+    """
+    將片頭重新編碼成與新聞影片相同的格式 (解析度、影格率、編碼、取樣率)，
+    之後才能用 concat 直接串接。轉好的檔案會依「片頭路徑 + 修改時間 + 目標格式」快取，
+    同一支片頭只需轉一次。
+    """
+    v, a = target["video"], target["audio"]
+    cache_key = hashlib.md5(
+        f"{os.path.abspath(intro_video_path)}|{os.path.getmtime(intro_video_path)}|{json.dumps(target, sort_keys=True)}".encode("utf-8")
+    ).hexdigest()[:12]
+    normalized_path = os.path.join(output_dir, f"intro_normalized_{cache_key}.mp4")
+    if os.path.exists(normalized_path):
+        print("    > 使用已轉換過的片頭")
+        return normalized_path
+
+    print("    > 片頭格式與新聞影片不同，正在轉換片頭格式 (僅需一次)...")
+    w, h = v["width"], v["height"]
+    cmd = ["ffmpeg", "-y", "-i", intro_video_path]
+    # 保持比例縮放，不足的部分補黑邊
+    video_filter = f"scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={v['r_frame_rate']},format={v['pix_fmt']}"
+
+    if a:
+        sample_rate = a["sample_rate"]
+        # 片頭沒有音軌時補一段靜音，否則串接後聲音會錯位
+        if probe_video(intro_video_path)["audio"] is None:
+            cmd += ["-f", "lavfi", "-i", f"anullsrc=channel_layout=stereo:sample_rate={sample_rate}", "-map", "0:v", "-map", "1:a", "-shortest"]
+        cmd += ["-c:a", "aac", "-ar", str(sample_rate), "-ac", str(a["channels"])]
+    else:
+        cmd += ["-an"]
+
+    time_scale = v["time_base"].split("/")[-1]
+    # -threads 0：由 ffmpeg/x264 依 CPU 核心數自動決定執行緒數
+    cmd += ["-vf", video_filter, "-c:v", "libx264", "-preset", X264_PRESET, "-crf", "23", "-threads", "0",
+            "-video_track_timescale", time_scale, normalized_path]
+    subprocess.run(cmd, check=True, capture_output=True)
+    return normalized_path
+
+def is_concat_compatible(info_a, info_b):
+    """
+    判斷兩支影片能否直接以 stream copy 串接 (影音格式需完全一致)。
+    """
+    video_keys = ("codec_name", "width", "height", "pix_fmt", "r_frame_rate", "time_base")
+    audio_keys = ("codec_name", "sample_rate", "channels")
+    va, vb = info_a["video"], info_b["video"]
+    if not va or not vb or any(va.get(k) != vb.get(k) for k in video_keys):
+        return False
+    aa, ab = info_a["audio"], info_b["audio"]
+    if (aa is None) != (ab is None):
+        return False
+    return aa is None or all(aa.get(k) == ab.get(k) for k in audio_keys)
+
 def merge_intro_and_news_video_only(intro_video_path, news_video_path, output_dir):
     """
-    使用 MoviePy 將「自選片頭」與「HeyGen 生成的新聞影片」合併。
+    使用 ffmpeg concat demuxer 將「自選片頭」與「HeyGen 生成的新聞影片」合併。
+    兩支影片格式相同時直接複製串流 (-c copy)，不需重新編碼；
+    格式不同時只轉換片頭一次 (並快取)，新聞影片仍直接複製。
     """
     print(f" [5/5] 正在進行後製 (合併影片)...")
-    merged_video_path = news_video_path
 
     try:
-        clip_intro = VideoFileClip(intro_video_path)
-        clip_news = VideoFileClip(news_video_path)
-        print(f"    > 片頭長度: {clip_intro.duration:.2f} 秒")
+        news_info = probe_video(news_video_path)
+        intro_info = probe_video(intro_video_path)
+        if not is_concat_compatible(intro_info, news_info):
+            intro_video_path = normalize_intro(intro_video_path, news_info, output_dir)
+
+        # concat 清單檔：路徑中的單引號需跳脫
+        list_path = os.path.join(output_dir, "concat_list.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            for path in (intro_video_path, news_video_path):
+                escaped = os.path.abspath(path).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
 
-        # 合併影片
-        final_clip = concatenate_videoclips([clip_intro, clip_news], method="compose")
         merged_video_path = os.path.join(output_dir, "final_merged_output.mp4")
-        
-        # 輸出檔案
-        final_clip.write_videofile(merged_video_path, codec="libx264", audio_codec="aac", verbose=False, logger=None)
-        
-        clip_intro.close()
-        clip_news.close()
+        subprocess.run([
+            "ffmpeg", "-y", "-f", "concat", "-safe", "0",
+            "-i", list_path, "-c", "copy", merged_video_path
+        ], check=True, capture_output=True)
         
         print("    > 影片合併完成！")
         return merged_video_path
@@ -601,16 +883,15 @@ if __name__ == "__main__":
         # 2. 爬取資料並製作 PPT
         pptx_path, scripts = fetch_content_and_make_pptx(topic, intro_script)
         
-        # 3. PPT 轉圖片
-        images = convert_pptx_to_images(pptx_path)
-
-        # 處理自定義封面 (若有)
+        # 3. 處理自定義封面 (若有)，接著 PPT 轉圖片，每完成一段就立即上傳
+        cover_path = None
         if custom_cover_img and os.path.exists(custom_cover_img):
-            final_cover_path = convert_custom_cover(custom_cover_img)
-            if final_cover_path: images[0] = final_cover_path
+            cover_path = convert_custom_cover(custom_cover_img)
+
+        bg_ids = upload_slides(convert_pptx_to_images(pptx_path), cover_path)
 
         # 4. HeyGen 生成影片
-        video_id = create_full_video(images, scripts)
+        video_id = create_full_video(bg_ids, scripts)
         heygen_video_path = os.path.join(OUTPUT_DIR, "heygen_raw.mp4")
         download_video(video_id, heygen_video_path)
         
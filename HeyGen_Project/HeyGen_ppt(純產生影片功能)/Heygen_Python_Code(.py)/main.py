@@ -1,7 +1,7 @@
 import os
-import time
 import requests
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from openpyxl import load_workbook
 from pathlib import Path
 from dotenv import load_dotenv
 import re
@@ -21,20 +21,38 @@ VOICE_ID_ZH = "4158cf2ef85d4ccc856aacb1c47dbb0c"
 ROOT = Path(__file__).parent if "__file__" in globals() else Path(os.getcwd())
 PNG_DIR = ROOT / "outputs" / "slides_png"
 SCRIPT_PATH = ROOT / "scripts" / "script.xlsx"
+UPLOAD_WORKERS = 5
+
+_CJK_RE = re.compile(r"[\u4e00-\u9fff]")
 
 def load_scripts(script_path: Path):
     try:
-        df = pd.read_excel(script_path)
-        df.columns = [c.lower() for c in df.columns]
-        df["text"] = df["text"].astype(str)
-        return dict(zip(df["slide"], df["text"]))
+        wb = load_workbook(script_path, read_only=True, data_only=True)
     except FileNotFoundError:
         print(f"找不到腳本檔案: {script_path}")
         return {}
 
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = [str(h).strip().lower() if h is not None else "" for h in next(rows, ())]
+        idx_slide = header.index("slide")
+        idx_text = header.index("text")
+
+        scripts = {}
+        for row in rows:
+            slide, text = row[idx_slide], row[idx_text]
+            if slide is None:
+                continue
+            if isinstance(slide, float) and slide.is_integer():
+                slide = int(slide)
+            scripts[slide] = "" if text is None else str(text)
+        return scripts
+    finally:
+        wb.close()
+
 
 def detect_voice_and_locale(text):
-    if re.search(r"[\u4e00-\u9fff]", text):
+    if _CJK_RE.search(text):
         return (VOICE_ID_ZH, "zh-TW")
     return (VOICE_ID_EN, "en-US")
 
@@ -55,8 +73,34 @@ def upload_image(img_path: Path):
     return r.json()["data"]["id"]
 
 
-def create_video(asset_id, text, slide_number):
+def build_scene(asset_id, text):
     voice_id, locale = detect_voice_and_locale(text)
+    return {
+        "character": {
+            "type": "talking_photo",
+            "talking_photo_id": TALKING_PHOTO_ID,
+            "scale": 0.3,
+            "offset": {"x": 0.4, "y": 0.4},
+            "talking_style": "stable",
+            "fit": "cover"
+        },
+        "voice": {
+            "type": "text",
+            "voice_id": voice_id,
+            "input_text": text,
+            "speed": 1.0,
+            "locale": locale
+        },
+        "background": {
+            "type": "image",
+            "image_asset_id": asset_id,
+            "fit": "contain"
+        }
+    }
+
+
+def create_video(items):
+    """把所有 (asset_id, text) 合成多場景，一次送出單一影片任務"""
     headers = {
         "x-api-key": HEYGEN_API_KEY,
         "Content-Type": "application/json"
@@ -64,30 +108,7 @@ def create_video(asset_id, text, slide_number):
 
     payload = {
         "caption": True,
-        "video_inputs": [
-            {
-                "character": {
-                    "type": "talking_photo",
-                    "talking_photo_id": TALKING_PHOTO_ID,
-                    "scale": 0.3,
-                    "offset": {"x": 0.4, "y": 0.4},
-                    "talking_style": "stable",
-                    "fit": "cover"
-                },
-                "voice": {
-                    "type": "text",
-                    "voice_id": voice_id,
-                    "input_text": text,
-                    "speed": 1.0,
-                    "locale": locale
-                },
-                "background": {
-                    "type": "image",
-                    "image_asset_id": asset_id,
-                    "fit": "contain"
-                }
-            }
-        ],
+        "video_inputs": [build_scene(asset_id, text) for asset_id, text in items],
         "dimension": {
             "width": 1280,
             "height": 720
@@ -121,23 +142,25 @@ def main():
         print("缺少腳本或投影片圖片，請檢查 'scripts/script.xlsx' 和 'outputs/slides_png/'")
         return
 
-    print(f"找到 {len(pngs)} 張投影片，準備發送 {len(scripts)} 個任務...")
+    print(f"找到 {len(pngs)} 張投影片，準備上傳 {len(scripts)} 頁...")
 
-    for i, img_path in enumerate(pngs, 1):
-        text = scripts.get(i, "")
-        if not text: continue
+    slides = [(img_path, scripts.get(i, "")) for i, img_path in enumerate(pngs, 1)]
+    slides = [(img_path, text) for img_path, text in slides if text]
 
-        print(f"\n--- Processing Slide {i} ---")
+    # 上傳彼此獨立，並行送出；map 會保持投影片順序
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as ex:
+        asset_ids = list(ex.map(upload_image, [img_path for img_path, _ in slides]))
 
+    items = [(asset_id, text) for asset_id, (_, text) in zip(asset_ids, slides) if asset_id]
 
-        asset_id = upload_image(img_path)
-        if not asset_id: continue
-
-        create_video(asset_id, text, i)
+    if not items:
+        print("沒有可用的投影片，未送出任務")
+        return
 
-        time.sleep(1)
+    print(f"\n合併 {len(items)} 個場景，送出單一影片任務...")
+    create_video(items)
 
-    print("\n 所有任務已發送完畢！")
+    print("\n 任務已發送完畢！")
     print("請手動至 HeyGen 後台 (Projects) 查看進度並下載影片。")
 
 
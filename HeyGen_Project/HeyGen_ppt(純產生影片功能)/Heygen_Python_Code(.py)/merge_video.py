@@ -2,8 +2,11 @@ import glob
 import subprocess
 import re
 
+_NUM_RE = re.compile(r'(\d+)')
+
 def natural_sort_key(s):
-    return [int(t) if t.isdigit() else t for t in re.findall(r'\d+|\D+', s)]
+    # split 後奇數位置一定是數字、偶數位置一定是文字，比較時型別永遠一致
+    return tuple(int(t) if t.isdigit() else t for t in _NUM_RE.split(s))
 
 videos = glob.glob(r"C:\Users\User\Downloads\video*.mp4")
 videos = sorted(videos, key=natural_sort_key)
@@ -16,7 +19,7 @@ with open("list.txt", "w", encoding="utf-8") as f:
         f.write(f"file '{v}'\n")
 
 cmd = [
-    "ffmpeg","-y"
+    "ffmpeg","-y",
     "-f", "concat",
     "-safe", "0",
     "-i", "list.txt",